@@ -0,0 +1,727 @@
+import os, re, sys, json, time, random, argparse, asyncio, ssl, shutil, subprocess, tempfile, platform
+import importlib.util
+from datetime import datetime, timezone
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+SCRIPT_DIR = Path(__file__).parent.resolve()
+FIXTURES_DIR = SCRIPT_DIR / "fixtures"
+RESULTS_FILE = SCRIPT_DIR / "benchmark_results.jsonl"
+
+# gift-parser.py is not importable by name (hyphen), load it explicitly.
+# Registered in sys.modules so worker processes can unpickle gift_parser.parse_page.
+_spec = importlib.util.spec_from_file_location("gift_parser", SCRIPT_DIR / "gift-parser.py")
+gift_parser = importlib.util.module_from_spec(_spec)
+sys.modules["gift_parser"] = gift_parser
+_spec.loader.exec_module(gift_parser)
+
+
+def load_fixture_pages(fixtures_dir: Path, pattern: str = "gift_*.html") -> list[str]:
+    pages = [p.read_text(encoding="utf-8") for p in sorted(fixtures_dir.glob(pattern))]
+    if not pages:
+        raise SystemExit(f"Нет HTML фикстур в {fixtures_dir}")
+    return pages
+
+
+def peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_revision() -> str | None:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def save_result(args, benchmark: str, params: dict, metrics: dict):
+    # One JSON line per run, so `compare` can diff runs of the same benchmark across versions
+    if args.no_save:
+        return
+    record = {
+        "benchmark": benchmark,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "label": args.label,
+        "python": platform.python_version(),
+        "params": params,
+        "metrics": metrics,
+    }
+    with open(args.results, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"Результат записан в {args.results}")
+
+
+def cmd_compare(args):
+    # For each benchmark and parameter set: latest run against the previous one (or the run with --baseline label)
+    results_path = Path(args.results)
+    if not results_path.exists():
+        raise SystemExit(f"Нет файла результатов {results_path}")
+    runs: dict[tuple, list[dict]] = {}
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                runs.setdefault((record["benchmark"], json.dumps(record["params"], sort_keys=True)), []).append(record)
+
+    for (benchmark, params_json), records in runs.items():
+        current = records[-1]
+        if args.baseline:
+            previous = next((r for r in reversed(records[:-1]) if r.get("label") == args.baseline), None)
+        else:
+            previous = records[-2] if len(records) > 1 else None
+        if previous is None:
+            continue
+        print(f"{benchmark} {params_json}")
+        print(f"  {previous.get('label') or previous.get('revision')} ({previous['timestamp']}) -> "
+              f"{current.get('label') or current.get('revision')} ({current['timestamp']})")
+        for key, new_value in current["metrics"].items():
+            old_value = previous["metrics"].get(key)
+            if not isinstance(old_value, (int, float)) or not isinstance(new_value, (int, float)):
+                continue
+            change = f"{(new_value - old_value) / old_value * 100:+.1f}%" if old_value else "n/a"
+            print(f"  {key:<36} {old_value:12.3f} -> {new_value:12.3f}  {change}")
+
+
+def cmd_check_parsers(args):
+    # Fast extractor and BeautifulSoup must produce identical fields and records for every fixture
+    mismatches = 0
+    fixture_paths = sorted(Path(args.fixtures).glob("*.html"))
+    for path in fixture_paths:
+        html = path.read_text(encoding="utf-8")
+        fast_fields = gift_parser.extract_page_fields_fast(html)
+        bs4_fields = gift_parser.extract_page_fields_bs4(html)
+        fast_item = gift_parser.parse_page(html, 1, "Check", parser_backend="fast")
+        bs4_item = gift_parser.parse_page(html, 1, "Check", parser_backend="bs4")
+        if fast_fields is not None and fast_fields != bs4_fields:
+            mismatches += 1
+            print(f"✗ {path.name}: поля различаются")
+            for key in bs4_fields:
+                if fast_fields.get(key) != bs4_fields[key]:
+                    print(f"    {key}: fast={fast_fields.get(key)!r} bs4={bs4_fields[key]!r}")
+        elif fast_item != bs4_item:
+            mismatches += 1
+            print(f"✗ {path.name}: записи различаются\n    fast={fast_item!r}\n    bs4={bs4_item!r}")
+        else:
+            note = " (быстрый разбор вернул None, используется BeautifulSoup)" if fast_fields is None else ""
+            print(f"✓ {path.name}{note}")
+    print(f"Проверено фикстур: {len(fixture_paths)}, расхождений: {mismatches}")
+    mutation_failures = check_mutated_pages(load_fixture_pages(Path(args.fixtures)), args.mutations, args.seed)
+    print(f"Проверено измененных страниц: {args.mutations}, расхождений и ошибок: {mutation_failures}")
+    if mismatches or mutation_failures:
+        sys.exit(1)
+
+
+_MUTATION_TAG_RE = re.compile(r"<(text|th|td|tr|div|svg)\b[^>]*>|</(text|th|td|tr|div|svg)>")
+
+
+def mutate_page(html: str, rng: random.Random) -> str:
+    # Broken markup the fast extractor must survive: duplicated or dropped tags, extra nested <text>
+    for _ in range(rng.randint(1, 3)):
+        tag = rng.choice(list(_MUTATION_TAG_RE.finditer(html)))
+        operation = rng.randrange(3)
+        if operation == 0:
+            html = html[:tag.start()] + tag.group(0) + html[tag.start():]
+        elif operation == 1:
+            html = html[:tag.start()] + html[tag.end():]
+        else:
+            html = html[:tag.end()] + "<text>x</text>" + html[tag.end():]
+    return html
+
+
+def check_mutated_pages(pages: list[str], count: int, seed: int) -> int:
+    # The fast extractor must not raise and must agree with BeautifulSoup wherever it returns fields
+    rng = random.Random(seed)
+    failures = 0
+    for i in range(count):
+        html = mutate_page(rng.choice(pages), rng)
+        try:
+            fast_fields = gift_parser.extract_page_fields_fast(html)
+        except Exception as e:
+            failures += 1
+            print(f"✗ измененная страница #{i}: быстрый разбор упал: {type(e).__name__} {e}")
+            continue
+        if fast_fields is not None and fast_fields != gift_parser.extract_page_fields_bs4(html):
+            failures += 1
+            print(f"✗ измененная страница #{i}: поля различаются")
+    return failures
+
+
+class SyntheticRangeDiscovery(gift_parser.RangeDiscovery):
+    # RangeDiscovery over an in-memory set of live IDs instead of HTTP probes
+    def __init__(self, live_ids: set[int], stride: int):
+        super().__init__(None, None, "Check", None, stride=stride)
+        self.live_ids = live_ids
+
+    async def exists(self, url_id: int) -> bool:
+        if url_id not in self.known:
+            self.probe_count += 1
+            self.known[url_id] = url_id in self.live_ids
+        return self.known[url_id]
+
+
+DISCOVERY_CASES = [
+    # (name, issued, burned ranges, --last) - IDs 1..issued are live except the burned ones
+    ("без пропусков", 1000, [], 1000),
+    ("пропуск в начале", 1000, [(1, 100)], 1000),
+    ("пропуск у конца", 1000, [(800, 990)], 1000),
+    ("короткий хвост после пропуска", 1120, [(900, 1090)], 1200),
+    ("несколько пропусков", 5000, [(1, 300), (1200, 1900), (4000, 4900)], 5500),
+    ("одиночные сожженные", 1000, [(10, 10), (500, 501), (999, 999)], 1000),
+]
+
+
+def cmd_check_discovery(args):
+    # Every live ID must fall into the discovered ranges (burned blocks may be partly kept, never live IDs dropped)
+    failures = 0
+    for name, issued, burned, id_last in DISCOVERY_CASES:
+        live_ids = {url_id for url_id in range(1, issued + 1)
+                    if not any(start <= url_id <= end for start, end in burned)}
+        discovery = SyntheticRangeDiscovery(live_ids, args.stride)
+        live_ranges = asyncio.run(discovery.discover(1, id_last))
+        covered = set(gift_parser.ids_within_ranges(range(1, id_last + 1), live_ranges))
+        missed = sorted(live_ids - covered)
+        extra = len(covered - live_ids)
+        if missed:
+            failures += 1
+            print(f"✗ {name}: пропущено {len(missed)} живых ID (первые: {missed[:10]}), диапазоны {live_ranges}")
+        else:
+            print(f"✓ {name}: диапазоны {live_ranges}, лишних ID {extra}, проверочных запросов {discovery.probe_count}")
+    print(f"Проверено случаев: {len(DISCOVERY_CASES)}, ошибок: {failures}")
+    if failures:
+        sys.exit(1)
+
+
+async def _parse_all(page_parser, pages: list[str], total: int, concurrency: int) -> int:
+    semaphore = asyncio.Semaphore(concurrency)
+    parsed = 0
+
+    async def one(i: int):
+        nonlocal parsed
+        async with semaphore:
+            if await page_parser.parse(pages[i % len(pages)], i, "Benchmark") is not None:
+                parsed += 1
+
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return parsed
+
+
+def bench_parse_workers(pages: list[str], total: int, parse_workers: int, concurrency: int,
+                        parser_backend: str = "auto") -> float:
+    pool = ProcessPoolExecutor(max_workers=parse_workers) if parse_workers > 0 else None
+    try:
+        if pool is not None:
+            # Warm up the workers so process start-up is not measured
+            list(pool.map(gift_parser.parse_page, pages, range(len(pages)), ["Benchmark"] * len(pages)))
+
+        async def run():
+            page_parser = gift_parser.PageParser(pool, parser_backend=parser_backend)
+            return await _parse_all(page_parser, pages, total, concurrency)
+
+        started = time.perf_counter()
+        asyncio.run(run())
+        return total / (time.perf_counter() - started)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def cmd_parse(args):
+    pages = load_fixture_pages(Path(args.fixtures))
+    max_workers = args.max_workers or os.cpu_count() or 1
+    worker_counts = [0] + sorted({n for n in (1, 2, 4, 8, 16, 32, max_workers) if n <= max_workers})
+
+    print(f"Разбор {args.pages} страниц ({len(pages)} фикстур), --parser {args.parser}, ядер: {os.cpu_count()}")
+    if (os.cpu_count() or 1) == 1 and not args.max_workers:
+        # Pool rows would only show the pickling overhead on the same core, not how parsing scales
+        worker_counts = [0]
+        print("  Доступно одно ядро CPU: масштабирование по процессам измерить нельзя, gift-parser.py на такой машине "
+              "разбирает HTML в основном процессе. Измерен только разбор без пула (--max-workers N - измерить пул принудительно).")
+    baseline = None
+    metrics = {}
+    for n in worker_counts:
+        pages_per_sec = bench_parse_workers(pages, args.pages, n, args.concurrency, args.parser)
+        if baseline is None:
+            baseline = pages_per_sec
+        metrics[f"parse_workers_{n}.pages_per_sec"] = round(pages_per_sec, 1)
+        label = "inline" if n == 0 else f"{n} proc"
+        print(f"  --parse-workers {n:<3} ({label:>8}): {pages_per_sec:9.1f} стр/с  x{pages_per_sec / baseline:.2f}")
+    save_result(args, "parse", {"pages": args.pages, "parser": args.parser, "concurrency": args.concurrency,
+                                "cpus": os.cpu_count()}, metrics)
+
+
+def time_calls(func, inputs: list, min_time: float) -> tuple[float, int]:
+    # Calls func over inputs repeatedly for at least min_time seconds; returns (seconds per call, calls)
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        for value in inputs:
+            func(*value)
+        calls += len(inputs)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return elapsed / calls, calls
+
+
+def cmd_micro(args):
+    pages = load_fixture_pages(Path(args.fixtures))
+    items = [gift_parser.parse_page(html, i, "Benchmark", parser_backend="bs4") for i, html in enumerate(pages)]
+    items = [item for item in items if item]
+    urls = [url for html in pages for url in re.findall(r'(?:srcset|href)="([^"]+)"', html)]
+    urls += ["//cdn4.cdn-telegram.org/file/a.tgs", "/file/pattern.png", "  https://cdn4.cdn-telegram.org/file/x.tgs  ", ""]
+    dest_dir = Path("Benchmark_tgs")
+
+    cases = [
+        ("parse_page (auto)", lambda html: gift_parser.parse_page(html, 1, "Benchmark", "auto"), [(html,) for html in pages]),
+        ("parse_page (bs4)", lambda html: gift_parser.parse_page(html, 1, "Benchmark", "bs4"), [(html,) for html in pages]),
+        ("normalize_url", gift_parser.normalize_url, [(url,) for url in urls]),
+        ("tgs_file_name_base", gift_parser.tgs_file_name_base, [(item.get("model"),) for item in items]),
+        ("pattern_file_name_base", gift_parser.pattern_file_name_base,
+         [(item.get("symbol"), item.get("pattern_png_url") or "https://cdn4.cdn-telegram.org/file/p.png") for item in items]),
+        ("build_download_target", gift_parser.build_download_target,
+         [(gift_parser.normalize_url(item.get("tgs_url") or "/file/a.tgs"), dest_dir, gift_parser.tgs_file_name_base(item.get("model")), ".tgs")
+          for item in items]),
+    ]
+    print(f"Микробенчмарки на {len(pages)} фикстурах, не менее {args.min_time} с на функцию")
+    metrics = {}
+    for name, func, inputs in cases:
+        seconds_per_call, calls = time_calls(func, inputs, args.min_time)
+        metrics[f"{name}.us_per_call"] = round(seconds_per_call * 1e6, 3)
+        print(f"  {name:<24}: {seconds_per_call * 1e6:10.2f} мкс/вызов  {1 / seconds_per_call:12.0f} вызовов/с  ({calls} вызовов)")
+    save_result(args, "micro", {"fixtures": len(pages), "min_time": args.min_time}, metrics)
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def make_self_signed_tls_context(work_dir: Path) -> ssl.SSLContext | None:
+    # TLS makes the per-connection handshake cost visible; needs the openssl command line tool
+    if shutil.which("openssl") is None:
+        return None
+    cert_path, key_path = work_dir / "stub.crt", work_dir / "stub.key"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+         "-keyout", str(key_path), "-out", str(cert_path)],
+        check=True, capture_output=True,
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+class StubBehaviour:
+    # What the stub t.me server does for each ID; all choices are deterministic by ID
+    def __init__(self, delay: float = 0.0, missing_every: int = 0, not_found_every: int = 0,
+                 slow_every: int = 0, slow_delay: float = 0.5, throttle_every: int = 0, retry_after: float = 1.0,
+                 asset_delay: float = 0.0):
+        self.delay = delay
+        self.missing_every = missing_every      # HTTP 404
+        self.not_found_every = not_found_every  # 200 with the "not found" page (burned NFT)
+        self.slow_every = slow_every
+        self.slow_delay = slow_delay
+        self.throttle_every = throttle_every    # 429 + Retry-After on the first request for the ID
+        self.retry_after = retry_after
+        self.asset_delay = asset_delay          # delay of every TGS/PNG response
+
+
+async def start_stub_server(pages: list[str], tls_context: ssl.SSLContext | None = None, delay: float = 0.0,
+                            behaviour: StubBehaviour | None = None, not_found_page: str = "",
+                            asset_bytes: int = 0):
+    # Local stand-in for t.me/nft: serves fixture pages under /nft/<slug>-<id>, gzip-compressed if asked.
+    # With asset_bytes, CDN links in the pages point back at the stub, which serves files of that size.
+    # Returns (runner, base_url, stats); call await runner.cleanup() when done.
+    from aiohttp import web
+
+    behaviour = behaviour or StubBehaviour(delay=delay)
+    stats = {"pages": 0, "missing": 0, "not_found": 0, "slow": 0, "throttled": 0, "assets": 0}
+    throttled_ids = set()
+    base_url = ""
+
+    def every(n: int, url_id: int) -> bool:
+        return n > 0 and url_id % n == 0
+
+    async def nft_page(request):
+        url_id = int(request.match_info["name"].rpartition("-")[2])
+        if behaviour.delay:
+            await asyncio.sleep(behaviour.delay)
+        if every(behaviour.throttle_every, url_id) and url_id not in throttled_ids:
+            throttled_ids.add(url_id)
+            stats["throttled"] += 1
+            return web.Response(status=429, headers={"Retry-After": str(behaviour.retry_after)})
+        if every(behaviour.slow_every, url_id):
+            stats["slow"] += 1
+            await asyncio.sleep(behaviour.slow_delay)
+        if every(behaviour.missing_every, url_id):
+            stats["missing"] += 1
+            return web.Response(status=404)
+        if every(behaviour.not_found_every, url_id):
+            stats["not_found"] += 1
+            html = not_found_page
+        else:
+            stats["pages"] += 1
+            html = pages[url_id % len(pages)]
+            if asset_bytes:
+                html = re.sub(r"(?:https:)?//cdn[\w.-]*", base_url, html).replace('"/file/', f'"{base_url}/file/')
+        response = web.Response(text=html, content_type="text/html")
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            response.enable_compression()
+        return response
+
+    async def asset(request):
+        stats["assets"] += 1
+        if behaviour.asset_delay:
+            await asyncio.sleep(behaviour.asset_delay)
+        return web.Response(body=b"\0" * asset_bytes)
+
+    async def stats_json(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_get("/nft/{name}", nft_page)
+    app.router.add_get("/_stats", stats_json)
+    app.router.add_get("/{path:.*}", asset)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=tls_context)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    base_url = f"{'https' if tls_context else 'http'}://127.0.0.1:{port}"
+    return runner, base_url, stats
+
+
+async def bench_http_options(http_options, base_url: str, total: int, concurrency: int) -> tuple[float, list[float], int]:
+    # Fetches total pages through fetch_html_async with the given settings; returns (pages/sec, latencies, failures)
+    latencies = []
+    failures = 0
+    async with http_options.make_session(concurrency, ssl=False) as session, \
+            http_options.page_transport(session, None, concurrency, ssl=False) as page_session:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i: int):
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                html, _, _ = await gift_parser.fetch_html_async(page_session, f"{base_url}/nft/Bench-{i}", i, None, retries=1)
+                latencies.append(time.perf_counter() - started)
+                if html is None:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        return total / (time.perf_counter() - started), latencies, failures
+
+
+def cmd_http(args):
+    pages = load_fixture_pages(Path(args.fixtures))
+    HttpOptions = gift_parser.HttpOptions
+    configurations = [
+        # Connector of earlier versions: TCPConnector(force_close=True) with aiohttp's default 10 s DNS cache
+        ("старый (force_close)", HttpOptions(keep_alive=False, dns_cache_ttl=10)),
+        ("keep-alive", HttpOptions()),
+        ("keep-alive, без сжатия", HttpOptions(compression=False)),
+    ]
+    if gift_parser.httpx is not None:
+        configurations.append(("httpx HTTP/2", HttpOptions(transport="httpx")))
+
+    async def run():
+        with tempfile.TemporaryDirectory() as work_dir:
+            tls_context = None if args.no_tls else make_self_signed_tls_context(Path(work_dir))
+            runner, base_url, _ = await start_stub_server(pages, tls_context, args.server_delay)
+            try:
+                print(f"Заглушка: {base_url}, запросов: {args.requests}, одновременно: {args.concurrency}")
+                baseline = None
+                metrics = {}
+                for label, http_options in configurations:
+                    try:
+                        pages_per_sec, latencies, failures = await bench_http_options(
+                            http_options, base_url, args.requests, args.concurrency)
+                    except RuntimeError as e:
+                        print(f"  {label:<24}: пропущено ({e})")
+                        continue
+                    baseline = baseline or pages_per_sec
+                    metrics[f"{label}.pages_per_sec"] = round(pages_per_sec, 1)
+                    metrics[f"{label}.p50_ms"] = round(percentile(latencies, 0.5) * 1000, 2)
+                    metrics[f"{label}.p99_ms"] = round(percentile(latencies, 0.99) * 1000, 2)
+                    print(f"  {label:<24}: {pages_per_sec:8.1f} стр/с  x{pages_per_sec / baseline:.2f}  "
+                          f"p50 {percentile(latencies, 0.5) * 1000:6.1f} мс  p99 {percentile(latencies, 0.99) * 1000:6.1f} мс"
+                          + (f"  ошибок: {failures}" if failures else ""))
+            finally:
+                await runner.cleanup()
+            save_result(args, "http", {"requests": args.requests, "concurrency": args.concurrency,
+                                       "server_delay": args.server_delay, "tls": tls_context is not None}, metrics)
+
+    asyncio.run(run())
+
+
+STUB_OPTIONS = ("fixtures", "server_delay", "missing_every", "not_found_every", "slow_every", "slow_delay",
+                "throttle_every", "retry_after", "asset_bytes", "asset_delay")
+
+
+def cmd_stub_server(args):
+    # The e2e stub in its own process, so its CPU time and memory are not counted as the scraper's.
+    # Prints the base URL as the first line of stdout and serves until terminated; GET /_stats returns its counters.
+    pages = load_fixture_pages(Path(args.fixtures))
+    not_found_page = (Path(args.fixtures) / "not_found.html").read_text(encoding="utf-8")
+    behaviour = StubBehaviour(args.server_delay, args.missing_every, args.not_found_every,
+                              args.slow_every, args.slow_delay, args.throttle_every, args.retry_after, args.asset_delay)
+
+    async def run():
+        runner, base_url, _ = await start_stub_server(pages, behaviour=behaviour, not_found_page=not_found_page,
+                                                      asset_bytes=args.asset_bytes)
+        print(base_url, flush=True)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def start_stub_process(args) -> tuple[subprocess.Popen, str]:
+    # Runs `benchmark.py stub-server` with the stub options of args; returns (process, base_url)
+    command = [sys.executable, str(Path(__file__).resolve()), "stub-server"]
+    for option in STUB_OPTIONS:
+        value = getattr(args, option)
+        if option == "asset_bytes" and not args.assets:
+            value = 0
+        command += [f"--{option.replace('_', '-')}", str(value)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    base_url = process.stdout.readline().strip()
+    if not base_url:
+        process.wait()
+        raise SystemExit(f"Заглушка не запустилась (код {process.returncode})")
+    return process, base_url
+
+
+def cmd_e2e(args):
+    # scrape_collection_async end to end against the stub: page fetches, parsing, JSONL output and
+    # (with --assets) downloads, with 404s, "not found" pages, slow responses and 429s mixed in.
+    # The stub runs in a separate process, so pages/s and peak RSS are the scraper's alone.
+    latencies = []
+    fetch_html_async = gift_parser.fetch_html_async
+
+    async def timed_fetch_html_async(*fetch_args, **fetch_kwargs):
+        started = time.perf_counter()
+        try:
+            return await fetch_html_async(*fetch_args, **fetch_kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    async def run(work_dir: Path, base_url: str) -> tuple[float, int, dict]:
+        gift_parser.NFT_BASE_URL = f"{base_url}/nft/"
+        gift_parser.fetch_html_async = timed_fetch_html_async
+        tgs_dir, pattern_dir = work_dir / "Bench_tgs", work_dir / "Bench_patterns"
+        tgs_dir.mkdir()
+        pattern_dir.mkdir()
+        sink = gift_parser.JsonlSink(work_dir / "bench.partial.jsonl")
+        try:
+            started = time.perf_counter()
+            await gift_parser.scrape_collection_async(
+                "Bench", 1, args.pages, args.delay, not args.assets, tgs_dir, pattern_dir, None,
+                args.workers, work_dir, args.download_workers, None, args.parser, sink,
+                rate_control=args.rate_control,
+            )
+            elapsed = time.perf_counter() - started
+        finally:
+            sink.close()
+            gift_parser.fetch_html_async = fetch_html_async
+        async with gift_parser.aiohttp.ClientSession() as session:
+            async with session.get(f"{base_url}/_stats") as response:
+                stats = await response.json()
+        return elapsed, sink.count, stats
+
+    process, base_url = start_stub_process(args)
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            elapsed, items, stats = asyncio.run(run(Path(work_dir), base_url))
+    finally:
+        process.terminate()
+        process.wait()
+
+    metrics = {
+        "pages_per_sec": round(args.pages / elapsed, 1),
+        "elapsed_sec": round(elapsed, 3),
+        "items": items,
+        "fetch_p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "fetch_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print(f"ID: {args.pages}, записей: {items}, время: {elapsed:.2f} с, {metrics['pages_per_sec']} стр/с")
+    print(f"Загрузка страницы (с повторами): p50 {metrics['fetch_p50_ms']} мс, p99 {metrics['fetch_p99_ms']} мс")
+    print(f"Пиковая память (RSS): {metrics['peak_rss_mb']} МБ")
+    print("Заглушка: " + ", ".join(f"{key}={value}" for key, value in stats.items()))
+    params = {key: getattr(args, key) for key in (
+        "pages", "workers", "download_workers", "rate_control", "delay", "parser", "assets", "asset_bytes",
+        "server_delay", "missing_every", "not_found_every", "slow_every", "slow_delay", "throttle_every", "retry_after")}
+    save_result(args, "e2e", params, metrics)
+
+
+def cmd_check_interrupt(args):
+    # --resume after an interrupted run: the run is cancelled while asset downloads (slowed by the stub) are
+    # in flight, the window where scraped items are not saved yet. Every ID marked "ok" in the state DB must
+    # then have its record in the .partial.jsonl, and a resumed run must finish the range with nothing lost.
+    async def scrape(work_dir: Path, state_store, url_ids=None):
+        tgs_dir, pattern_dir = work_dir / "Check_tgs", work_dir / "Check_patterns"
+        tgs_dir.mkdir(exist_ok=True)
+        pattern_dir.mkdir(exist_ok=True)
+        sink = gift_parser.JsonlSink(work_dir / "check.partial.jsonl")
+        try:
+            await gift_parser.scrape_collection_async(
+                "Check", 1, args.pages, 0, False, tgs_dir, pattern_dir, None, args.workers, work_dir,
+                args.download_workers, item_sink=sink, state_store=state_store, url_ids=url_ids,
+            )
+        finally:
+            # Same order as process_one_collection_async on an interrupt
+            sink.close()
+            state_store.commit()
+
+    def saved_ids(work_dir: Path) -> set[int]:
+        with open(work_dir / "check.partial.jsonl", "r", encoding="utf-8") as f:
+            return {int(json.loads(line)["page_scraped_url"].rpartition("-")[2]) for line in f if line.strip()}
+
+    def ok_ids(state_store) -> set[int]:
+        return {url_id for (url_id,) in state_store.conn.execute(
+            "SELECT url_id FROM scrape_state WHERE collection_slug = ? AND status = ?", ("Check", gift_parser.STATE_OK))}
+
+    async def run(work_dir: Path, base_url: str) -> int:
+        gift_parser.NFT_BASE_URL = f"{base_url}/nft/"
+        state_store = gift_parser.ScrapeStateStore(work_dir / "state.sqlite3")
+        failures = 0
+        try:
+            try:
+                await asyncio.wait_for(scrape(work_dir, state_store), args.interrupt_after)
+                print(f"✗ запуск завершился раньше прерывания через {args.interrupt_after} с, увеличьте --asset-delay")
+                failures += 1
+            except asyncio.TimeoutError:
+                pass
+            lost = sorted(ok_ids(state_store) - saved_ids(work_dir))
+            if lost:
+                failures += 1
+                print(f"✗ после прерывания: {len(lost)} ID отмечены ok без записи (первые: {lost[:10]})")
+            else:
+                print(f"✓ после прерывания: ok {len(ok_ids(state_store))}, записей {len(saved_ids(work_dir))}")
+
+            await scrape(work_dir, state_store, list(state_store.ids_to_fetch("Check", 1, args.pages)))
+            remaining = list(state_store.ids_to_fetch("Check", 1, args.pages))
+            lost = sorted(ok_ids(state_store) - saved_ids(work_dir))
+            if lost or remaining:
+                failures += 1
+                print(f"✗ после --resume: без записи {len(lost)} ID (первые: {lost[:10]}), не обработано {len(remaining)}")
+            else:
+                print(f"✓ после --resume: ok {len(ok_ids(state_store))}, записей {len(saved_ids(work_dir))}")
+        finally:
+            state_store.close()
+        return failures
+
+    stub_args = argparse.Namespace(
+        fixtures=args.fixtures, assets=True, asset_bytes=1000, asset_delay=args.asset_delay, server_delay=0.0,
+        missing_every=args.missing_every, not_found_every=0, slow_every=0, slow_delay=0.0, throttle_every=0, retry_after=1.0)
+    process, base_url = start_stub_process(stub_args)
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            failures = asyncio.run(run(Path(work_dir), base_url))
+    finally:
+        process.terminate()
+        process.wait()
+    print(f"Ошибок: {failures}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарки скрейпера gift-parser.py.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # Options shared by benchmarks whose results are recorded
+    results_options = argparse.ArgumentParser(add_help=False)
+    results_options.add_argument("--results", type=str, default=str(RESULTS_FILE), help="Файл истории результатов (JSON Lines).")
+    results_options.add_argument("--label", type=str, default=None, help="Метка прогона (например, имя ветки) для compare --baseline.")
+    results_options.add_argument("--no-save", action="store_true", help="Не записывать результат в историю.")
+
+    p_parse = subparsers.add_parser("parse", parents=[results_options], help="Пропускная способность parse_page в зависимости от --parse-workers.")
+    p_parse.add_argument("--fixtures", type=str, default=str(FIXTURES_DIR), help="Папка с HTML страницами.")
+    p_parse.add_argument("--pages", type=int, default=2000, help="Сколько страниц разобрать на каждый прогон.")
+    p_parse.add_argument("--max-workers", type=int, default=0, help="Максимальное число процессов (по умолчанию - число ядер).")
+    p_parse.add_argument("--concurrency", type=int, default=64, help="Число одновременных задач разбора (как --workers).")
+    p_parse.add_argument("--parser", type=str, choices=gift_parser.PARSER_BACKENDS, default="auto", help="Способ разбора HTML.")
+    p_parse.set_defaults(func=cmd_parse)
+
+    p_check = subparsers.add_parser("check-parsers", help="Сравнить результаты быстрого разбора и BeautifulSoup на фикстурах.")
+    p_check.add_argument("--fixtures", type=str, default=str(FIXTURES_DIR), help="Папка с HTML страницами.")
+    p_check.add_argument("--mutations", type=int, default=3000, help="Сколько случайно измененных страниц (лишние/пропущенные/вложенные теги) проверить дополнительно.")
+    p_check.add_argument("--seed", type=int, default=1, help="Начальное значение генератора для измененных страниц.")
+    p_check.set_defaults(func=cmd_check_parsers)
+
+    p_discovery = subparsers.add_parser("check-discovery", help="Проверить --discover-range на синтетических коллекциях с сожженными диапазонами.")
+    p_discovery.add_argument("--stride", type=int, default=64, help="Как --discover-stride скрейпера.")
+    p_discovery.set_defaults(func=cmd_check_discovery)
+
+    p_http = subparsers.add_parser("http", parents=[results_options], help="Скорость загрузки страниц с локальной заглушки: старый коннектор против keep-alive/HTTP2.")
+    p_http.add_argument("--fixtures", type=str, default=str(FIXTURES_DIR), help="Папка с HTML страницами.")
+    p_http.add_argument("--requests", type=int, default=2000, help="Сколько страниц загрузить в каждой конфигурации.")
+    p_http.add_argument("--concurrency", type=int, default=10, help="Число одновременных запросов (как --workers).")
+    p_http.add_argument("--server-delay", type=float, default=0.0, help="Задержка ответа заглушки в секундах.")
+    p_http.add_argument("--no-tls", action="store_true", help="Обычный HTTP вместо HTTPS с самоподписанным сертификатом.")
+    p_http.set_defaults(func=cmd_http)
+
+    p_micro = subparsers.add_parser("micro", parents=[results_options], help="Микробенчмарки parse_page, normalize_url и формирования имен файлов.")
+    p_micro.add_argument("--fixtures", type=str, default=str(FIXTURES_DIR), help="Папка с HTML страницами.")
+    p_micro.add_argument("--min-time", type=float, default=1.0, help="Минимальное время измерения каждой функции в секундах.")
+    p_micro.set_defaults(func=cmd_micro)
+
+    # Behaviour of the stub t.me server, shared by e2e, check-interrupt and the stub-server process they start
+    stub_options = argparse.ArgumentParser(add_help=False)
+    stub_options.add_argument("--fixtures", type=str, default=str(FIXTURES_DIR), help="Папка с HTML страницами (и not_found.html).")
+    stub_options.add_argument("--asset-bytes", type=int, default=50_000, help="Размер файлов, отдаваемых заглушкой.")
+    stub_options.add_argument("--asset-delay", type=float, default=0.0, help="Задержка ответа заглушки на запрос файла в секундах.")
+    stub_options.add_argument("--server-delay", type=float, default=0.005, help="Базовая задержка ответа заглушки в секундах.")
+    stub_options.add_argument("--missing-every", type=int, default=50, help="Каждый N-й ID отвечает 404 (0 - никогда).")
+    stub_options.add_argument("--not-found-every", type=int, default=0, help="Каждый N-й ID отдает страницу \"не найден\" (0 - никогда).")
+    stub_options.add_argument("--slow-every", type=int, default=100, help="Каждый N-й ID отвечает с задержкой --slow-delay.")
+    stub_options.add_argument("--slow-delay", type=float, default=0.5, help="Задержка медленных ответов в секундах.")
+    stub_options.add_argument("--throttle-every", type=int, default=200, help="Каждый N-й ID сначала отвечает 429 (0 - никогда).")
+    stub_options.add_argument("--retry-after", type=float, default=1.0, help="Значение Retry-After для ответов 429.")
+
+    p_e2e = subparsers.add_parser("e2e", parents=[results_options, stub_options], help="scrape_collection_async целиком против локальной заглушки t.me с 404, медленными ответами и 429.")
+    p_e2e.add_argument("--pages", type=int, default=2000, help="Сколько ID обработать.")
+    p_e2e.add_argument("--workers", type=int, default=10, help="Как --workers скрейпера.")
+    p_e2e.add_argument("--download-workers", type=int, default=4, help="Как --download-workers скрейпера.")
+    p_e2e.add_argument("--rate-control", type=str, choices=gift_parser.RATE_CONTROL_MODES, default="adaptive", help="Как --rate-control скрейпера.")
+    p_e2e.add_argument("--delay", type=float, default=0.0, help="Как --delay скрейпера (для --rate-control fixed).")
+    p_e2e.add_argument("--parser", type=str, choices=gift_parser.PARSER_BACKENDS, default="auto", help="Способ разбора HTML.")
+    p_e2e.add_argument("--assets", action="store_true", help="Скачивать TGS/PNG с заглушки (по умолчанию как --json-only).")
+    p_e2e.set_defaults(func=cmd_e2e)
+
+    p_interrupt = subparsers.add_parser("check-interrupt", help="Проверить, что прерванный во время скачивания файлов запуск не теряет ID при --resume.")
+    p_interrupt.add_argument("--fixtures", type=str, default=str(FIXTURES_DIR), help="Папка с HTML страницами (и not_found.html).")
+    p_interrupt.add_argument("--pages", type=int, default=200, help="Сколько ID обработать.")
+    p_interrupt.add_argument("--workers", type=int, default=10, help="Как --workers скрейпера.")
+    p_interrupt.add_argument("--download-workers", type=int, default=4, help="Как --download-workers скрейпера.")
+    p_interrupt.add_argument("--missing-every", type=int, default=50, help="Каждый N-й ID отвечает 404 (0 - никогда).")
+    p_interrupt.add_argument("--asset-delay", type=float, default=2.0, help="Задержка ответа заглушки на запрос файла в секундах.")
+    p_interrupt.add_argument("--interrupt-after", type=float, default=1.0, help="Через сколько секунд прервать первый запуск (должно быть меньше --asset-delay).")
+    p_interrupt.set_defaults(func=cmd_check_interrupt)
+
+    # Started by e2e and check-interrupt in a subprocess; not meant to be run by hand
+    p_stub = subparsers.add_parser("stub-server", parents=[stub_options], help="Заглушка t.me в отдельном процессе (запускается из e2e и check-interrupt).")
+    p_stub.set_defaults(func=cmd_stub_server)
+
+    p_compare = subparsers.add_parser("compare", help="Сравнить последний прогон каждого бенчмарка с предыдущим.")
+    p_compare.add_argument("--results", type=str, default=str(RESULTS_FILE), help="Файл истории результатов (JSON Lines).")
+    p_compare.add_argument("--baseline", type=str, default=None, help="Сравнивать с последним прогоном с этой меткой --label.")
+    p_compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)